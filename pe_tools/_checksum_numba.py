@@ -0,0 +1,19 @@
+import numpy as np
+from numba import njit
+
+@njit(cache=True, nogil=True)
+def _word_sum_kernel(a, parity):
+    r = np.uint64(0)
+    n = a.shape[0]
+    i = parity
+    if parity and n:
+        r += np.uint64(a[0]) << np.uint64(8)
+    while i + 1 < n:
+        r += np.uint64(a[i]) | (np.uint64(a[i + 1]) << np.uint64(8))
+        i += 2
+    if i < n:
+        r += np.uint64(a[i])
+    return r
+
+def word_sum(buf, parity=0):
+    return int(_word_sum_kernel(np.frombuffer(buf, dtype=np.uint8), parity))
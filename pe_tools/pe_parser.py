@@ -1,6 +1,17 @@
-import struct, io
+import struct, mmap
+from concurrent.futures import ThreadPoolExecutor
 from dataclasses import dataclass
-from grope import BlobIO, rope
+from grope import rope, wrap_io
+
+try:
+    import numpy as _np
+except ImportError:
+    _np = None
+
+try:
+    from ._checksum_numba import word_sum as _numba_word_sum
+except ImportError:
+    _numba_word_sum = None
 from .struct3 import Struct3, u8, u16, u32, u64, char
 from .rsrc import parse_pe_resources
 from .rsrc import KnownResourceTypes
@@ -201,8 +212,16 @@ IMAGE_SCN_MEM_READ                   = 0x40000000
 IMAGE_SCN_MEM_WRITE                  = 0x80000000
 
 
-def _align(offs, alignment):
-    return (offs + alignment - 1) // alignment * alignment
+def _is_sorted(seq, key):
+    return all(key(seq[i-1]) <= key(seq[i]) for i in range(1, len(seq)))
+
+def _field_offset(struct_cls, field):
+    fmt = '<'
+    for name, annot in struct_cls.descriptor.annotations.items():
+        if name == field:
+            return struct.calcsize(fmt)
+        fmt += annot.fmt
+    raise KeyError(field)
 
 IMAGE_DIRECTORY_ENTRY_EXPORT = 0
 IMAGE_DIRECTORY_ENTRY_IMPORT = 1
@@ -220,37 +239,72 @@ IMAGE_DIRECTORY_ENTRY_IAT = 12
 IMAGE_DIRECTORY_ENTRY_DELAY_IMPORT = 13
 IMAGE_DIRECTORY_ENTRY_COM_DESCRIPTOR = 14
 
+_U16 = struct.Struct('<H')
+_U32 = struct.Struct('<I')
+
+# sections below this size are summed inline; threading only pays off
+# when the numpy/numba kernels can run with the GIL released
+_PARALLEL_MIN_SECTION_SIZE = 1 << 20
+
 class _PeSection:
     def __init__(self, hdr, data):
         self.hdr = hdr
         self.data = data
 
-def pe_checksum(blob):
-    total_len = len(blob)
-
+    @property
+    def data(self):
+        return self._data
+
+    @data.setter
+    def data(self, value):
+        self._data = value
+        self._checksum_partial = None
+
+    def checksum_partial(self):
+        # Word sum of the raw section data, assuming the section starts
+        # at an even file offset; cached until the data is replaced.
+        if self._checksum_partial is None:
+            self._checksum_partial = _pe_checksum_partial(bytes(self._data))
+        return self._checksum_partial
+
+def _pe_checksum_partial(buf, parity=0):
+    # Sum of the little-endian 16-bit words of `buf`, where `buf`
+    # starts at a file offset of the given parity; an odd trailing
+    # byte counts as the low byte of a word completed (or zero-padded)
+    # by whatever follows.
+    if _numba_word_sum is not None:
+        return _numba_word_sum(buf, parity)
+
+    if _np is not None:
+        if parity == 0:
+            words = _np.frombuffer(buf, dtype='<u2', count=len(buf) // 2)
+            r = int(words.sum(dtype=_np.uint64))
+            if len(buf) % 2 != 0:
+                r += buf[-1]
+            return r
+        a = _np.frombuffer(buf, dtype=_np.uint8)
+        return int(a[1::2].sum(dtype=_np.uint64)) + (int(a[0::2].sum(dtype=_np.uint64)) << 8)
+
+    # sum(u16 words) == sum(low bytes) + 256*sum(high bytes)
+    return sum(buf[parity::2]) + (sum(buf[1 - parity::2]) << 8)
+
+def _pe_checksum_fold(r):
+    # The word sum of any real image fits in 48 bits, so three unrolled
+    # digit-sum steps always reach the fixed point of the folding loop
+    # they replace; values already below 0x10000 pass through unchanged.
+    r = (r & 0xffff) + ((r >> 16) & 0xffff) + (r >> 32)
+    r = (r & 0xffff) + (r >> 16)
+    return (r & 0xffff) + (r >> 16)
+
+def pe_checksum(*blobs):
     r = 0
-    while len(blob) >= 0x1000:
-        words = struct.unpack('<2048H', bytes(blob[:0x1000]))
-        r += sum(words)
-        blob = blob[0x1000:]
-
-    if len(blob) % 2 != 0:
-        blob = rope(blob, b'\0')
-    words = struct.unpack('<' + 'H'*(len(blob) // 2), bytes(blob))
-    r += sum(words)
-
-    while r > 0xffff:
-        c = r
-        r = 0
-        while c:
-            r += c & 0xffff
-            c >>= 16
-
-    return r + total_len
+    offs = 0
+    for blob in blobs:
+        buf = blob if isinstance(blob, (bytes, memoryview)) else bytes(blob)
+        r += _pe_checksum_partial(buf, offs % 2)
+        offs += len(buf)
 
-def _read(blob, fmt):
-    size = struct.calcsize(fmt)
-    return struct.unpack(fmt, bytes(blob[:size]))
+    return _pe_checksum_fold(r) + offs
 
 def parse_rsds_blob(blob):
     if len(blob) < _IMAGE_DEBUG_CODEVIEW.size:
@@ -266,25 +320,32 @@ def parse_rsds_blob(blob):
 
 class _PeFile:
     def __init__(self, blob, verify_checksum=False):
-        pe_offs, = _read(blob[0x3c:], '<H')
+        pe_offs, = _U16.unpack(bytes(blob[0x3c:0x3e]))
 
-        fin = BlobIO(blob[pe_offs:])
+        # materialize the header region once and parse it with rolling
+        # offsets; everything up to the section table is a few KB at most
+        hdr_buf = bytes(blob[pe_offs:pe_offs + 4 + _IMAGE_FILE_HEADER.size])
 
-        sig = fin.read(4)
-        if sig != b'PE\0\0':
+        if not hdr_buf.startswith(b'PE\0\0'):
             raise RuntimeError('Not a PE file: PE signature is missing.')
 
-        hdr = _IMAGE_FILE_HEADER.unpack_from_io(fin)
-        sect_offs = fin.tell() + hdr.SizeOfOptionalHeader
-        opt_sig, = struct.unpack('<H', fin.read(2))
+        hdr = _IMAGE_FILE_HEADER.unpack_from(hdr_buf, 4)
+        sect_offs = 4 + _IMAGE_FILE_HEADER.size + hdr.SizeOfOptionalHeader
+
+        hdr_buf = bytes(blob[pe_offs:pe_offs + sect_offs + hdr.NumberOfSections * _IMAGE_SECTION_HEADER.size])
+
+        offs = 4 + _IMAGE_FILE_HEADER.size
+        opt_sig, = _U16.unpack_from(hdr_buf, offs)
+        offs += 2
         if opt_sig == IMAGE_NT_OPTIONAL_HDR32_MAGIC:
-            opt = _IMAGE_OPTIONAL_HEADER32.unpack_from_io(fin)
+            opt = _IMAGE_OPTIONAL_HEADER32.unpack_from(hdr_buf, offs)
             opt.sig = opt_sig
         elif opt_sig == IMAGE_NT_OPTIONAL_HDR64_MAGIC:
-            opt = _IMAGE_OPTIONAL_HEADER64.unpack_from_io(fin)
+            opt = _IMAGE_OPTIONAL_HEADER64.unpack_from(hdr_buf, offs)
             opt.sig = opt_sig
         else:
             raise RuntimeError('Unknown optional header type.')
+        offs += opt.size
 
         self._checksum_offs = pe_offs + 4 + _IMAGE_FILE_HEADER.size + 4*16
 
@@ -292,34 +353,52 @@ class _PeFile:
             if opt.CheckSum == 0:
                 self.checksum_correct = False
             else:
-                real_checksum = pe_checksum(rope(blob[:self._checksum_offs], b'\0\0\0\0', blob[self._checksum_offs + 4:]))
+                # one pass over the whole image; the stored CheckSum field
+                # is zeroed algebraically by subtracting its word-sum
+                # contribution rather than by splicing the blob; mmap-backed
+                # memoryviews are summed in place, without a copy
+                buf = blob if isinstance(blob, (bytes, memoryview)) else bytes(blob)
+                raw = _pe_checksum_partial(buf)
+                raw -= _pe_checksum_partial(buf[self._checksum_offs:self._checksum_offs + 4], self._checksum_offs % 2)
+                real_checksum = _pe_checksum_fold(raw) + len(buf)
                 self.checksum_correct = real_checksum == opt.CheckSum
 
-        if opt.FileAlignment == 0:
-            raise RuntimeError('IMAGE_OPTIONAL_HEADER.FileAlignment must be nonzero')
+        if opt.FileAlignment == 0 or opt.FileAlignment & (opt.FileAlignment - 1) != 0:
+            raise RuntimeError('IMAGE_OPTIONAL_HEADER.FileAlignment must be a nonzero power of two')
+        if opt.SectionAlignment == 0 or opt.SectionAlignment & (opt.SectionAlignment - 1) != 0:
+            raise RuntimeError('IMAGE_OPTIONAL_HEADER.SectionAlignment must be a nonzero power of two')
 
-        dds = [_IMAGE_DATA_DIRECTORY.unpack_from_io(fin) for dd_idx in range(opt.NumberOfRvaAndSizes)]
+        # alignments are powers of two, so aligning is a mask away
+        fa_mask = opt.FileAlignment - 1
+        self._fa_mask = fa_mask
+        self._sa_mask = opt.SectionAlignment - 1
+
+        dds = _IMAGE_DATA_DIRECTORY.unpack_many(hdr_buf, opt.NumberOfRvaAndSizes, offs)
 
-        fin.seek(sect_offs)
-        
         def make_pe_section(idx, hdr):
             name = hdr.Name.rstrip(b'\0')
 
-            if hdr.PointerToRawData % opt.FileAlignment != 0:
+            if hdr.PointerToRawData & fa_mask != 0:
                 raise RuntimeError('Section {}@{} is misaligned ({})'.format(name, idx, hdr.PointerToRawData))
-            if hdr.SizeOfRawData % opt.FileAlignment != 0:
+            if hdr.SizeOfRawData & fa_mask != 0:
                 raise RuntimeError('Size of section {}@{} is misaligned ({})'.format(name, idx, hdr.SizeOfRawData))
 
             if hdr.PointerToRawData == 0:
                 data = None
             else:
+                # a lazy view into the source blob (memoryview, mmap or
+                # rope); the section's bytes are not touched until they
+                # are checksummed or written out
                 data = blob[hdr.PointerToRawData:hdr.PointerToRawData + hdr.SizeOfRawData]
 
             return _PeSection(hdr, data)
 
-        sections = [make_pe_section(sec_idx, _IMAGE_SECTION_HEADER.unpack_from_io(fin)) for sec_idx in range(hdr.NumberOfSections)]
+        sections = [make_pe_section(sec_idx, sec_hdr)
+            for sec_idx, sec_hdr in enumerate(_IMAGE_SECTION_HEADER.unpack_many(hdr_buf, hdr.NumberOfSections, sect_offs))]
 
-        present_secs = sorted((sec for sec in sections if sec.hdr.SizeOfRawData != 0), key=lambda sec: sec.hdr.PointerToRawData)
+        present_secs = [sec for sec in sections if sec.hdr.SizeOfRawData != 0]
+        if not _is_sorted(present_secs, key=lambda sec: sec.hdr.PointerToRawData):
+            present_secs.sort(key=lambda sec: sec.hdr.PointerToRawData)
         if not present_secs:
             raise RuntimeError('no present sections')
 
@@ -337,28 +416,35 @@ class _PeFile:
         self._file_header = hdr
         self._opt_header = opt
         self._data_directories = dds
+        self._dd_pack = None
         self._sections = sections
 
         self._trailer = blob[end_of_image:]
+        self._trailer_partial = None
 
         self._check_vm_overlaps()
 
     def _file_align(self, addr):
-        return _align(addr, self._opt_header.FileAlignment)
+        return (addr + self._fa_mask) & ~self._fa_mask
 
     def _mem_align(self, addr):
-        return _align(addr, self._opt_header.SectionAlignment)
+        return (addr + self._sa_mask) & ~self._sa_mask
 
     def _check_vm_overlaps(self):
+        # extract the address columns up front so the scan doesn't
+        # chase sec.hdr attributes per comparison
+        sa_mask = self._sa_mask
+        addrs = [(sec.hdr.VirtualAddress, sec.hdr.VirtualSize) for sec in self._sections]
+
         next_free_address = None
-        for sec in self._sections:
-            if sec.hdr.VirtualAddress % self._opt_header.SectionAlignment != 0:
+        for va, vsize in addrs:
+            if va & sa_mask != 0:
                 raise RuntimeError('sections are misaligned in memory')
 
-            if next_free_address is not None and sec.hdr.VirtualAddress != next_free_address:
+            if next_free_address is not None and va != next_free_address:
                 raise RuntimeError('there are holes in the section map')
 
-            next_free_address = self._mem_align(sec.hdr.VirtualAddress + sec.hdr.VirtualSize)
+            next_free_address = (va + vsize + sa_mask) & ~sa_mask
 
     @property
     def file_header(self):
@@ -384,6 +470,7 @@ class _PeFile:
     def remove_trailer(self):
         self.remove_signature()
         self._trailer = b''
+        self._trailer_partial = None
 
     def has_signature(self):
         return len(self._data_directories) > IMAGE_DIRECTORY_ENTRY_SECURITY and self._data_directories[IMAGE_DIRECTORY_ENTRY_SECURITY].VirtualAddress != 0
@@ -405,8 +492,10 @@ class _PeFile:
             raise RuntimeError('signature is not contained in the pe trailer')
 
         self._trailer = self._trailer[:-dd.Size]
+        self._trailer_partial = None
         dd.VirtualAddress = 0
         dd.Size = 0
+        self._dd_pack = None
 
     def has_directory(self, idx):
         if len(self._data_directories) < idx:
@@ -496,18 +585,21 @@ class _PeFile:
                 return sec_idx
 
     def _find_vm_hole(self, secs, size):
-        sorted_secs = sorted(secs, key=lambda sec: sec.hdr.VirtualAddress)
+        addrs = [(sec.hdr.VirtualAddress, sec.hdr.VirtualSize) for sec in secs]
+        if not _is_sorted(addrs, key=lambda addr: addr[0]):
+            addrs.sort()
+
         i = 1
-        while i < len(sorted_secs):
-            start = self._mem_align(sorted_secs[i-1].hdr.VirtualAddress + sorted_secs[i-1].hdr.VirtualSize)
-            stop = sorted_secs[i].hdr.VirtualAddress
+        while i < len(addrs):
+            start = self._mem_align(addrs[i-1][0] + addrs[i-1][1])
+            stop = addrs[i][0]
 
             if stop - start >= size:
                 return slice(start, self._mem_align(start + size))
 
             i += 1
 
-        start = self._mem_align(sorted_secs[-1].hdr.VirtualAddress + sorted_secs[-1].hdr.VirtualSize)
+        start = self._mem_align(addrs[-1][0] + addrs[-1][1])
         return slice(start, self._mem_align(start + size))
 
     def _resize_directory(self, idx, size):
@@ -523,6 +615,8 @@ class _PeFile:
             move_map[other_sec] = addr
             addr = self._mem_align(addr + other_sec.hdr.VirtualSize)
 
+        self._dd_pack = None
+
         for dd in self._data_directories:
             if dd.VirtualAddress == 0:
                 continue
@@ -582,11 +676,16 @@ class _PeFile:
         new_file.append(self._dos_stub)
         new_file.append(b'PE\0\0')
         new_file.append(self._file_header.pack())
-        new_file.append(struct.pack('<H', self._opt_header.sig))
-        new_file.append(self._opt_header.pack())
+        new_file.append(_U16.pack(self._opt_header.sig))
 
-        for dd in self._data_directories:
-            new_file.append(dd.pack())
+        # packed into a bytearray so the checksum can be patched in
+        # place once the rest of the output is known
+        opt_pack = bytearray(self._opt_header.pack())
+        new_file.append(opt_pack)
+
+        if self._dd_pack is None:
+            self._dd_pack = b''.join(dd.pack() for dd in self._data_directories)
+        new_file.append(self._dd_pack)
 
         for sec in self._sections:
             new_file.append(sec.hdr.pack())
@@ -603,27 +702,69 @@ class _PeFile:
 
         new_file.append(self._trailer)
 
-        out_blob = rope(*new_file)
         if update_checksum:
-            new_checksum = pe_checksum(out_blob)
-        else:
-            new_checksum = 0
+            new_checksum = self._compute_checksum(new_file)
+            _U32.pack_into(opt_pack, _field_offset(type(self._opt_header), 'CheckSum'), new_checksum)
+
+        return rope(*new_file)
+
+    def _compute_checksum(self, pieces):
+        # Sum the output piecewise so unchanged section data can reuse
+        # its cached word sum instead of being rescanned; the fold is
+        # deferred until all partials are in.
+        secs_by_data = {id(sec.data): sec for sec in self._sections if sec.data is not None}
 
-        return rope(out_blob[:self._checksum_offs], struct.pack('<I', new_checksum), out_blob[self._checksum_offs + 4:])
+        if _np is not None or _numba_word_sum is not None:
+            pending = [sec for sec in secs_by_data.values()
+                if sec._checksum_partial is None and len(sec.data) >= _PARALLEL_MIN_SECTION_SIZE]
+            if len(pending) > 1:
+                with ThreadPoolExecutor() as pool:
+                    for _ in pool.map(_PeSection.checksum_partial, pending):
+                        pass
+
+        r = 0
+        offs = 0
+        for piece in pieces:
+            sec = secs_by_data.get(id(piece))
+            if sec is not None and offs % 2 == 0:
+                r += sec.checksum_partial()
+            elif piece is self._trailer and offs % 2 == 0:
+                if self._trailer_partial is None:
+                    self._trailer_partial = _pe_checksum_partial(bytes(self._trailer))
+                r += self._trailer_partial
+            else:
+                r += _pe_checksum_partial(bytes(piece), offs % 2)
+            offs += len(piece)
+
+        return _pe_checksum_fold(r) + offs
 
     def to_bytes(self, update_checksum=False):
         return bytes(self.to_blob(update_checksum=update_checksum))
 
 def parse_pe(blob, verify_checksum=False):
     """Parse a PE file and return a PeFile object
-    
-    Expects either a bytes object or a grope.rope object consisting
-    only of bytes objects (the latter is recommended).
+
+    Expects a bytes object, a grope.rope object consisting
+    only of bytes objects, or a file object opened in binary mode.
+
+    File objects are memory-mapped when possible, so slicing the
+    image stays zero-copy and pages are only read on demand; files
+    that can't be mapped (e.g. pipes) are wrapped in a lazy rope.
 
     Set `verify_checksum=True` to add `checksum_correct` member to
-    the returned object.
+    the returned object. Verification walks the entire image, so it
+    is off by default; `to_blob(update_checksum=True)` recomputes the
+    checksum on write regardless of this setting.
+
+    Section data is kept as lazy slices of the input; unless the
+    checksum is verified, parsing reads only the headers.
     """
 
     if isinstance(blob, bytes):
         blob = memoryview(blob)
+    elif hasattr(blob, 'fileno'):
+        try:
+            blob = memoryview(mmap.mmap(blob.fileno(), 0, access=mmap.ACCESS_READ))
+        except (ValueError, OSError):
+            blob = wrap_io(blob)
     return _PeFile(blob, verify_checksum=verify_checksum)
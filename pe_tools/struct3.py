@@ -26,12 +26,39 @@ class StructDescriptor:
         fmt = ['<']
         fmt.extend(annot.fmt for annot in annotations.values())
         self.fmt = ''.join(fmt)
-        self.size = struct.calcsize(self.fmt)
+        self.struct = struct.Struct(self.fmt)
+        self.size = self.struct.size
 
     @property
     def names(self):
         return self.annotations.keys()
 
+def _compile_methods(descriptor):
+    # Partially evaluate the field walk: each struct class gets
+    # straight-line unpack/pack functions generated at class
+    # construction, leaving one compiled Struct call per operation.
+    names = list(descriptor.names)
+    args = ', '.join('v{}'.format(i) for i in range(len(names)))
+    if len(names) == 1:
+        args += ','
+
+    lines = ['def unpack_from(cls, buffer, offset = 0):']
+    lines.append('    if not isinstance(buffer, bytes):')
+    lines.append('        buffer = bytes(buffer[offset:offset + {}])'.format(descriptor.size))
+    lines.append('        offset = 0')
+    lines.append('    {} = _s.unpack_from(buffer, offset)'.format(args))
+    lines.append('    r = cls()')
+    for i, name in enumerate(names):
+        lines.append('    r.{} = v{}'.format(name, i))
+    lines.append('    return r')
+
+    lines.append('def pack(self):')
+    lines.append('    return _s.pack({})'.format(', '.join('self.{}'.format(name) for name in names)))
+
+    ns = {'_s': descriptor.struct}
+    exec('\n'.join(lines), ns)
+    return classmethod(ns['unpack_from']), ns['pack']
+
 class StructMeta(type):
     def __new__(cls, name, bases, namespace, no_struct_members=False, **kwds):
         self = super().__new__(cls, name, bases, namespace, **kwds)
@@ -42,6 +69,13 @@ class StructMeta(type):
                 setattr(self, name, annot.default)
             self.size = self.descriptor.size
 
+            if self.descriptor.annotations:
+                unpack_from, pack = _compile_methods(self.descriptor)
+                if 'unpack_from' not in namespace:
+                    self.unpack_from = unpack_from
+                if 'pack' not in namespace:
+                    self.pack = pack
+
         return self
 
 class Struct3(metaclass=StructMeta, no_struct_members=True):
@@ -79,7 +113,7 @@ class Struct3(metaclass=StructMeta, no_struct_members=True):
 
     @classmethod
     def unpack(cls, buffer):
-        data = struct.unpack(cls.descriptor.fmt, bytes(buffer))
+        data = cls.descriptor.struct.unpack(bytes(buffer))
 
         r = cls()
         for k, v in zip(cls.descriptor.annotations, data):
@@ -90,15 +124,31 @@ class Struct3(metaclass=StructMeta, no_struct_members=True):
     def unpack_from(cls, buffer, offset = 0):
         desc = cls.descriptor
         if isinstance(buffer, bytes):
-            data = struct.unpack_from(desc.fmt, buffer, offset)
+            data = desc.struct.unpack_from(buffer, offset)
         else:
-            data = struct.unpack(desc.fmt, bytes(buffer[offset:offset+desc.size]))
+            data = desc.struct.unpack(bytes(buffer[offset:offset+desc.size]))
 
         r = cls()
         for k, v in zip(desc.annotations, data):
             setattr(r, k, v)
         return r
 
+    @classmethod
+    def unpack_many(cls, buffer, count, offset = 0):
+        desc = cls.descriptor
+        buffer = bytes(buffer[offset:offset + count * desc.size])
+        if len(buffer) != count * desc.size:
+            raise struct.error('unpack_many requires a buffer of {} bytes'.format(count * desc.size))
+
+        rs = []
+        names = desc.names
+        for data in desc.struct.iter_unpack(buffer):
+            r = cls()
+            for k, v in zip(names, data):
+                setattr(r, k, v)
+            rs.append(r)
+        return rs
+
     @classmethod
     def unpack_from_io(cls, fileobj):
         return cls.unpack_from(fileobj.read(cls.calcsize()))